@@ -1,12 +1,20 @@
 import os
+import sqlite3
+import tempfile
+import zipfile
+from copy import deepcopy
 from datetime import date
-from typing import List
+from functools import lru_cache
+from typing import IO, Dict, List, Optional, Sequence, Tuple
+from xml.sax.saxutils import escape
 
 from flask import (
     Flask, render_template, request, redirect, url_for,
     jsonify, flash, send_file, abort
 )
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import case, event, func
+from sqlalchemy.engine import Engine
 
 # ======== DOCX helpers ========
 try:
@@ -14,22 +22,69 @@ try:
     from docx import Document
     from docx.shared import Pt, Cm
     from docx.enum.text import WD_ALIGN_PARAGRAPH
-    from docx.oxml.ns import qn
+    from docx.oxml import OxmlElement, parse_xml
+    from docx.oxml.ns import nsdecls, qn
     _DOCX_ENABLED = True
 except Exception:
     _DOCX_ENABLED = False
 
+# ======== Optional fast JSON ========
+try:
+    import orjson
+    from flask.json.provider import DefaultJSONProvider
+
+    class ORJSONProvider(DefaultJSONProvider):
+        def dumps(self, obj, **kwargs):
+            return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+
+    _ORJSON_ENABLED = True
+except Exception:
+    _ORJSON_ENABLED = False
+
 # ---------------- Config ----------------
 ITEMS_TOTAL = 40
 DISCONTINUE_THRESHOLD = 28   # >= 28 => discontinue
 ONE_BELOW_THRESHOLD = 16     # 16..27 => start one below; 0..15 => two below
+DOCX_MIMETYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+_DOCX_SPOOL_MAX = 2 * 1024 * 1024  # bytes of an export kept in RAM before spilling to disk
 
 app = Flask(__name__)
 app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "dev-secret")
 app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///philiri.db"
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+# Keep a small pool of open SQLite connections so the per-connection PRAGMAs
+# below run once per connection rather than once per request.
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+    "connect_args": {"check_same_thread": False},
+    "pool_size": 5,
+    "max_overflow": 10,
+    "pool_pre_ping": False,
+}
+if _ORJSON_ENABLED:
+    app.json = ORJSONProvider(app)
 db = SQLAlchemy(app)
 
+def _py_upper(s):
+    # str.strip().upper(), exposed to SQLite: its own upper()/trim() only handle
+    # ASCII letters and spaces, which would disagree with _sort_key on "Ñ" or tabs
+    return (s or "").strip().upper()
+
+@event.listens_for(Engine, "connect")
+def _sqlite_pragmas(dbapi_conn, _record):
+    if not isinstance(dbapi_conn, sqlite3.Connection):
+        return
+    dbapi_conn.create_function("py_upper", 1, _py_upper, deterministic=True)
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")      # safe with WAL; fsync at checkpoints only
+    cur.execute("PRAGMA temp_store=MEMORY")
+    cur.execute("PRAGMA cache_size=-20000")       # ~20 MB page cache
+    cur.execute("PRAGMA mmap_size=134217728")     # 128 MB
+    cur.close()
+
 # ---------------- Models ----------------
 class Class(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -42,6 +97,11 @@ class Class(db.Model):
     date_text = db.Column(db.String(40), default="")
 
 class Learner(db.Model):
+    __table_args__ = (
+        db.Index("ix_learner_class_name", "class_id", "name"),
+        db.Index("ix_learner_class_gender_id", "class_id", "gender", "id"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     class_id = db.Column(db.Integer, db.ForeignKey("class.id"), nullable=False)
     name = db.Column(db.String(120), default="")
@@ -64,35 +124,118 @@ def clamp(n, lo, hi):
 def compute_total(lit, inf, cri):
     return int(lit or 0) + int(inf or 0) + int(cri or 0)
 
+@lru_cache(maxsize=None)
 def starting_point_for(grade: int, total: int) -> str:
+    # pure over a tiny domain (grade 1..12, total 0..120), so results are memoized
     if total >= DISCONTINUE_THRESHOLD:
         return "DISCONTINUE"
     base = max(1, int(grade) - 1)
     start_level = max(1, base - 1 if total >= ONE_BELOW_THRESHOLD else base - 2)
     return f"Grade {start_level}"
 
-def _gender_bucket(g: str) -> int:
-    g = (g or "").strip().upper()
-    if g.startswith("M"):
-        return 0
-    if g.startswith("F"):
-        return 1
-    return 2
+@lru_cache(maxsize=None)
+def _starting_point_table(grade: int) -> Tuple[str, ...]:
+    """
+    starting_point_for(grade, t) for every possible total t in 0..3*ITEMS_TOTAL,
+    so per-learner lookups are a tuple index. GST rows are already below the
+    discontinue threshold; only negative totals (unvalidated input) fall back
+    to starting_point_for.
+    """
+    return tuple(starting_point_for(grade, t) for t in range(3 * ITEMS_TOTAL + 1))
+
+def _sort_key(r: dict) -> Tuple[int, str]:
+    # gender bucket (M -> 0, F -> 1, else 2), then name; sorted() calls this once per row
+    g = (r.get("gender", "") or "").strip().upper()
+    bucket = 0 if g.startswith("M") else 1 if g.startswith("F") else 2
+    return bucket, (r.get("name", "") or "").strip().upper()
 
 def _sort_rows(rows: List[dict]) -> List[dict]:
-    return sorted(
-        rows,
-        key=lambda r: (_gender_bucket(r.get("gender", "")),
-                       (r.get("name", "") or "").strip().upper())
+    return sorted(rows, key=_sort_key)
+
+def _gender_order():
+    # SQL mirror of _sort_key's gender bucket: M -> 0, F -> 1, anything else -> 2
+    g = func.py_upper(Learner.gender)
+    return case((g.like("M%"), 0), (g.like("F%"), 1), else_=2)
+
+def _gst_total(lang: str):
+    return (
+        func.coalesce(getattr(Learner, f"{lang}_literal"), 0)
+        + func.coalesce(getattr(Learner, f"{lang}_inferential"), 0)
+        + func.coalesce(getattr(Learner, f"{lang}_critical"), 0)
     )
 
+def _gst_order() -> tuple:
+    return (
+        _gender_order(),
+        func.py_upper(Learner.name),
+        Learner.name,
+        Learner.id,
+    )
+
+def _gst_row(name, gender, score: int, sp_table: Tuple[str, ...], grade: int) -> dict:
+    # negative totals (unvalidated input) are the only ones outside sp_table
+    sp = sp_table[score] if score >= 0 else starting_point_for(grade, score)
+    return {"name": name, "gender": gender, "score": score, "start": sp}
+
+def _collect_gst_rows(cls: Class, lang: str = "eng") -> List[dict]:
+    """
+    GST rows for learners of `cls` who took the `lang` ("eng"/"fil") test and
+    did not discontinue. Filtering (including the discontinue threshold),
+    totals and ordering run in SQL, so the result is already in _sort_rows
+    order and only kept rows are formatted here.
+    """
+    total = _gst_total(lang).label("total")
+    q = (
+        db.session.query(Learner.name, Learner.gender, total)
+        .filter(
+            Learner.class_id == cls.id,
+            getattr(Learner, f"took_{lang}").is_(True),
+            total < DISCONTINUE_THRESHOLD,
+        )
+        .order_by(*_gst_order())
+    )
+    grade = int(cls.grade)
+    sp_table = _starting_point_table(grade)
+    return [_gst_row(name, gender, score, sp_table, grade) for name, gender, score in q]
+
+def _collect_gst_rows_both(cls: Class) -> Tuple[List[dict], List[dict]]:
+    """
+    (ENG rows, FIL rows) from a single learner query; same filtering and
+    order as two _collect_gst_rows calls.
+    """
+    q = (
+        db.session.query(
+            Learner.name, Learner.gender, Learner.took_eng, Learner.took_fil,
+            _gst_total("eng"), _gst_total("fil"),
+        )
+        .filter(Learner.class_id == cls.id)
+        .order_by(*_gst_order())
+    )
+    grade = int(cls.grade)
+    sp_table = _starting_point_table(grade)
+    rows_eng, rows_fil = [], []
+    for name, gender, took_eng, took_fil, eng_score, fil_score in q:
+        if took_eng and eng_score < DISCONTINUE_THRESHOLD:
+            rows_eng.append(_gst_row(name, gender, eng_score, sp_table, grade))
+        if took_fil and fil_score < DISCONTINUE_THRESHOLD:
+            rows_fil.append(_gst_row(name, gender, fil_score, sp_table, grade))
+    return rows_eng, rows_fil
+
+def _cls_dict(c: Class) -> dict:
+    return {
+        "teacher": c.teacher, "school": c.school, "grade": c.grade,
+        "section": c.section, "date_text": c.date_text
+    }
+
 # ======== Template paths ========
+@lru_cache(maxsize=None)
 def _template_path_eng() -> str:
     here = os.path.dirname(os.path.abspath(__file__))
     a = os.path.join(here, "static", "docs", "Portrait_Header-Footer.docx")
     b = "/mnt/data/Portrait_Header-Footer.docx"
     return a if os.path.isfile(a) else b
 
+@lru_cache(maxsize=None)
 def _template_path_fil() -> str:
     here = os.path.dirname(os.path.abspath(__file__))
     a = os.path.join(here, "static", "docs", "Portrait_Header-FIL.docx")
@@ -106,10 +249,6 @@ def _set_p_no_space(p):
     pf.space_after = Pt(0)
     pf.line_spacing = 1
 
-def _set_cell_paras_no_space(cell):
-    for p in cell.paragraphs:
-        _set_p_no_space(p)
-
 def _docx_set_defaults(doc):
     style = doc.styles['Normal']
     style.font.name = 'Book Antiqua'
@@ -123,36 +262,121 @@ def _docx_set_defaults(doc):
     pf.space_after = Pt(0)
     pf.line_spacing = 1
 
+@lru_cache(maxsize=4)
+def _prebaked_template_bytes(path: str, mtime: float) -> bytes:
+    """
+    Template bytes with _docx_set_defaults already applied, so requests only
+    parse them. mtime is part of the cache key so an edited template is re-baked.
+    """
+    doc = Document(path)
+    _docx_set_defaults(doc)
+    bio = BytesIO()
+    doc.save(bio)
+    return bio.getvalue()
+
 # ======== Helpers that write into template tables ========
-def _cell_set_text(cell, text, *, bold=False, underline=False, align=None, upper=True):
+def _cell_writer(*, bold=False, underline=False, align=None, upper=True):
     """
-    Write text into a table cell using one tight paragraph and one run.
+    Return a `write(cell, text)` that puts text into a table cell using one
+    tight paragraph and one run, with the options below fixed up front so the
+    returned writer does no per-call branching:
     - bold: for labels only
     - underline: for values only (text underline, not cell border)
-    - align: optional paragraph alignment
+    - align: optional paragraph alignment (None keeps the template's)
     - upper: values often uppercase to match samples
     """
-    # Don't wipe existing styled labels unless we're writing a value.
-    cell.text = ""
-    p = cell.paragraphs[0]
-    _set_p_no_space(p)
-    if align is not None:
-        p.alignment = align
-    run_text = (text or "")
-    run_text = run_text.upper() if upper else run_text
-    r = p.add_run(run_text)
-    r.bold = bool(bold)
-    if underline:
-        r.underline = True
+    bold = bool(bold)
+    underline = True if underline else None  # None leaves a fresh run without <w:u>
+    transform = str.upper if upper else str
+
+    def write(cell, text):
+        cell.text = ""
+        p = cell.paragraphs[0]
+        _set_p_no_space(p)
+        r = p.add_run(transform(text or ""))
+        r.bold = bold
+        r.underline = underline
+        return p
+
+    if align is None:
+        return write
+
+    def write_aligned(cell, text):
+        write(cell, text).alignment = align
+
+    return write_aligned
+
+# One writer per option combination the builders actually use.
+_write_value = _cell_writer(underline=True)
+_write_label = _cell_writer(bold=True, upper=False)
+_write_upper = _cell_writer()
+if _DOCX_ENABLED:
+    _write_header = _cell_writer(bold=True, align=WD_ALIGN_PARAGRAPH.CENTER, upper=False)
+    _write_center = _cell_writer(align=WD_ALIGN_PARAGRAPH.CENTER, upper=False)
+    _write_center_upper = _cell_writer(align=WD_ALIGN_PARAGRAPH.CENTER)
+
+# Results rows are built as raw WordprocessingML: one tight paragraph with one
+# non-bold run per cell, i.e. what the _cell_writer writers produce, minus the wrapper objects.
+_RESULT_TC_XML = (
+    '<w:tc><w:p><w:pPr>'
+    '<w:spacing w:before="0" w:after="0" w:line="240" w:lineRule="auto"/>{jc}</w:pPr>'
+    '<w:r><w:rPr><w:b w:val="0"/></w:rPr><w:t xml:space="preserve">{text}</w:t></w:r>'
+    '</w:p></w:tc>'
+)
+_JC_CENTER = '<w:jc w:val="center"/>'
+# #, NAME, GENDER, SCORE, START -- everything but the name is centered
+_RESULT_COL_JC = (_JC_CENTER, "", _JC_CENTER, _JC_CENTER, _JC_CENTER)
+
+def _results_row_props(results_tbl) -> Tuple[Optional[object], List[Optional[object]]]:
+    """
+    (<w:trPr>, [<w:tcPr> per column]) to stamp onto new results rows. Taken whole
+    from the template's first data row so row heights and cell borders carry
+    over; with only a header row, just its cell widths are reused.
+    """
+    trs = results_tbl._tbl.tr_lst
+    if len(trs) > 1:
+        src = trs[1]
+        return src.trPr, [tc.tcPr for tc in src.tc_lst]
+    tc_prs = []
+    for tc in trs[0].tc_lst:
+        tcW = tc.tcPr.tcW if tc.tcPr is not None else None
+        if tcW is None:
+            tc_prs.append(None)
+        else:
+            tcPr = OxmlElement("w:tcPr")
+            tcPr.append(deepcopy(tcW))
+            tc_prs.append(tcPr)
+    return None, tc_prs
+
+def _results_row_xml(ncols: int, values: Sequence[str]) -> str:
+    cells = []
+    for i in range(ncols):
+        cells.append(_RESULT_TC_XML.format(
+            jc=_RESULT_COL_JC[i] if i < len(_RESULT_COL_JC) else "",
+            text=escape(values[i]) if i < len(values) else "",
+        ))
+    return f'<w:tr>{"".join(cells)}</w:tr>'
+
+def _parse_results_rows(rows_xml: List[str]) -> list:
+    """Parse all <w:tr> strings in one go; returns the row elements."""
+    wrapper = parse_xml(f'<w:rows {nsdecls("w")}>{"".join(rows_xml)}</w:rows>')
+    return list(wrapper)
 
 def _norm(s: str) -> str:
     return (s or "").strip().lower()
 
-def _looks_like_meta_table(tbl) -> bool:
+def _first_row_texts(tbl) -> List[str]:
+    """Text of each cell in the table's first row, read with one XPath per cell."""
+    return ["".join(tc.xpath(".//w:t/text()")) for tc in tbl._tbl.xpath("./w:tr[1]/w:tc")]
+
+def _looks_like_meta_table(tbl, first_row: Optional[List[str]] = None) -> bool:
     try:
-        if len(tbl.rows) >= 3 and len(tbl.columns) >= 4:
-            a = _norm(tbl.cell(0, 0).text)   # left label row 1
-            b = _norm(tbl.cell(0, 2).text)   # right label row 1
+        if len(tbl._tbl.tr_lst) >= 3 and len(tbl._tbl.tblGrid.gridCol_lst) >= 4:
+            texts = first_row if first_row is not None else _first_row_texts(tbl)
+            if len(texts) < 3:
+                return False
+            a = _norm(texts[0])   # left label row 1
+            b = _norm(texts[2])   # right label row 1
             # English OR Filipino labels
             return (
                 (a.startswith("teacher") and b.startswith("grade")) or
@@ -162,79 +386,100 @@ def _looks_like_meta_table(tbl) -> bool:
         pass
     return False
 
-def _looks_like_results_table(tbl) -> bool:
+# Each group needs at least one keyword in the results header (English / Filipino).
+_RESULTS_HEADER_KEYWORDS = (("NAME", "PANGALAN"), ("GENDER", "KASARIAN"), ("SCORE", "MARKA"))
+
+def _looks_like_results_table(tbl, first_row: Optional[List[str]] = None) -> bool:
     try:
-        hdr = " ".join((c.text or "").strip().upper() for c in tbl.rows[0].cells)
-        has_name = ("NAME" in hdr) or ("PANGALAN" in hdr)
-        has_gender = ("GENDER" in hdr) or ("KASARIAN" in hdr)
-        has_score = ("SCORE" in hdr) or ("MARKA" in hdr)
-        return has_name and has_gender and has_score
+        texts = first_row if first_row is not None else _first_row_texts(tbl)
+        hdr = " ".join(t.strip() for t in texts).upper()
+        return all(any(k in hdr for k in group) for group in _RESULTS_HEADER_KEYWORDS)
     except Exception:
         return False
 
+# (template path, mtime) -> (meta table index, results table index), or None
+# when the template has no usable tables. Positions are fixed per template file.
+_TEMPLATE_TABLE_IDX: Dict[Tuple[str, float], Optional[Tuple[int, int]]] = {}
+
+def _find_template_tables(doc: Document) -> Optional[Tuple[int, int]]:
+    meta_idx = None
+    results_idx = None
+    for i, t in enumerate(doc.tables):
+        first_row = _first_row_texts(t)
+        if meta_idx is None and _looks_like_meta_table(t, first_row):
+            meta_idx = i
+        elif results_idx is None and _looks_like_results_table(t, first_row):
+            results_idx = i
+        if meta_idx is not None and results_idx is not None:
+            return meta_idx, results_idx
+    return None
+
 def _fill_template_tables(
     doc: Document,
     cls_dict: dict,
     rows: List[dict],
     *,
-    type_of_test_text: str
+    type_of_test_text: str,
+    template_key: Optional[Tuple[str, float]] = None
 ) -> bool:
     """
     Populate the meta table and the results table that already exist in the template.
+    `template_key` (path, mtime) lets the table positions be looked up only once.
     We DO NOT touch label cells, to preserve any color/formatting in the template
     (especially the Filipino red labels). We only write the VALUE cells:
       row0 col1/3, row1 col1/3, row2 col1/3
     """
-    meta_tbl = None
-    results_tbl = None
-    for t in doc.tables:
-        if meta_tbl is None and _looks_like_meta_table(t):
-            meta_tbl = t
-        elif results_tbl is None and _looks_like_results_table(t):
-            results_tbl = t
-        if meta_tbl and results_tbl:
-            break
-
-    if meta_tbl is None or results_tbl is None:
+    if template_key is not None and template_key in _TEMPLATE_TABLE_IDX:
+        idx = _TEMPLATE_TABLE_IDX[template_key]
+    else:
+        idx = _find_template_tables(doc)
+        if template_key is not None:
+            _TEMPLATE_TABLE_IDX[template_key] = idx
+    if idx is None:
         return False
+    meta_tbl, results_tbl = doc.tables[idx[0]], doc.tables[idx[1]]
 
     # --- Meta values (underlined, not bold) ---
-    _cell_set_text(meta_tbl.cell(0, 1), cls_dict.get("teacher", ""), underline=True)
-    _cell_set_text(meta_tbl.cell(0, 3), str(cls_dict.get("grade", "")), underline=True)
-
-    _cell_set_text(meta_tbl.cell(1, 1), cls_dict.get("school", ""), underline=True)
-    _cell_set_text(meta_tbl.cell(1, 3), cls_dict.get("section", ""), underline=True)
+    _write_value(meta_tbl.cell(0, 1), cls_dict.get("teacher", ""))
+    _write_value(meta_tbl.cell(0, 3), str(cls_dict.get("grade", "")))
 
-    _cell_set_text(meta_tbl.cell(2, 1), type_of_test_text, underline=True)
-    _cell_set_text(meta_tbl.cell(2, 3), cls_dict.get("date_text", ""), underline=True)
+    _write_value(meta_tbl.cell(1, 1), cls_dict.get("school", ""))
+    _write_value(meta_tbl.cell(1, 3), cls_dict.get("section", ""))
 
-    for r in meta_tbl.rows:
-        for c in r.cells:
-            _set_cell_paras_no_space(c)
+    _write_value(meta_tbl.cell(2, 1), type_of_test_text)
+    _write_value(meta_tbl.cell(2, 3), cls_dict.get("date_text", ""))
 
     # --- Results table (reuse header already in template) ---
-    start_row_index = 1  # row 0 is header
-    needed = start_row_index + max(1, len(rows))
-    while len(results_tbl.rows) < needed:
-        results_tbl.add_row()
-
-    for i, rec in enumerate(rows, start=1):
-        cells = results_tbl.rows[start_row_index + (i - 1)].cells
-        _cell_set_text(cells[0], str(i), align=WD_ALIGN_PARAGRAPH.CENTER, upper=False)
-        _cell_set_text(cells[1], rec.get("name", ""))
-        _cell_set_text(cells[2], rec.get("gender", ""), align=WD_ALIGN_PARAGRAPH.CENTER)
-        _cell_set_text(cells[3], str(rec.get("score", "")), align=WD_ALIGN_PARAGRAPH.CENTER, upper=False)
-        _cell_set_text(cells[4], rec.get("start", ""), align=WD_ALIGN_PARAGRAPH.CENTER)
-        for c in cells:
-            _set_cell_paras_no_space(c)
-
-    # Blank out extra template rows (keep borders)
-    for r in results_tbl.rows[start_row_index + len(rows):]:
-        for c in r.cells:
-            _cell_set_text(c, "", upper=False)
-
-    for c in results_tbl.rows[0].cells:
-        _set_cell_paras_no_space(c)
+    # Template data rows are replaced by freshly built ones; at least as many
+    # rows as the template had are written so the blank bordered rows remain.
+    tbl = results_tbl._tbl
+    trPr, tc_prs = _results_row_props(results_tbl)
+    template_rows = tbl.tr_lst[1:]  # row 0 is header
+    for tr in template_rows:
+        tbl.remove(tr)
+    blank = ("",) * len(tc_prs)
+    rows_xml = []
+    for i in range(max(len(template_rows), len(rows), 1)):
+        if i < len(rows):
+            rec = rows[i]
+            values = (
+                str(i + 1),
+                (rec.get("name", "") or "").upper(),
+                (rec.get("gender", "") or "").upper(),
+                str(rec.get("score", "")),
+                (rec.get("start", "") or "").upper(),
+            )
+        else:
+            values = blank
+        rows_xml.append(_results_row_xml(len(tc_prs), values))
+    new_rows = _parse_results_rows(rows_xml)
+    for tr in new_rows:
+        if trPr is not None:
+            tr.insert(0, deepcopy(trPr))
+        for tc, tcPr in zip(tr.tc_lst, tc_prs):
+            if tcPr is not None:
+                tc.insert(0, deepcopy(tcPr))
+    tbl.extend(new_rows)
 
     return True
 
@@ -257,23 +502,23 @@ def _fallback_build(doc: Document, cls_dict: dict, rows: List[dict], *, title1:
         (type_of_test_text, cls_dict.get("date_text", "")),
     ]
     for r in range(3):
-        _cell_set_text(t.cell(r, 0), labels[r][0], bold=True, upper=False)
-        _cell_set_text(t.cell(r, 1), vals[r][0], underline=True)
-        _cell_set_text(t.cell(r, 2), labels[r][1], bold=True, upper=False)
-        _cell_set_text(t.cell(r, 3), vals[r][1], underline=True)
+        _write_label(t.cell(r, 0), labels[r][0])
+        _write_value(t.cell(r, 1), vals[r][0])
+        _write_label(t.cell(r, 2), labels[r][1])
+        _write_value(t.cell(r, 3), vals[r][1])
 
     # Results
     rt = doc.add_table(rows=1, cols=5)
     headers = ("#", "NAME", "GENDER", "SCORE", "START LEVEL OF GRADE PASSAGE")
     for i, h in enumerate(headers):
-        _cell_set_text(rt.rows[0].cells[i], h, bold=True, align=WD_ALIGN_PARAGRAPH.CENTER, upper=False)
+        _write_header(rt.rows[0].cells[i], h)
     for i, rec in enumerate(rows, start=1):
         row = rt.add_row().cells
-        _cell_set_text(row[0], str(i), align=WD_ALIGN_PARAGRAPH.CENTER, upper=False)
-        _cell_set_text(row[1], rec.get("name", ""))
-        _cell_set_text(row[2], rec.get("gender", ""), align=WD_ALIGN_PARAGRAPH.CENTER)
-        _cell_set_text(row[3], str(rec.get("score", "")), align=WD_ALIGN_PARAGRAPH.CENTER, upper=False)
-        _cell_set_text(row[4], rec.get("start", ""), align=WD_ALIGN_PARAGRAPH.CENTER)
+        _write_center(row[0], str(i))
+        _write_upper(row[1], rec.get("name", ""))
+        _write_center_upper(row[2], rec.get("gender", ""))
+        _write_center(row[3], str(rec.get("score", "")))
+        _write_center_upper(row[4], rec.get("start", ""))
 
 # ======== Builders for ENG / FIL ========
 def _build_gst_docx_from_template(
@@ -284,26 +529,29 @@ def _build_gst_docx_from_template(
     title1: str,
     title2: str,
     type_of_test_text: str
-) -> BytesIO:
+) -> IO[bytes]:
     if not _DOCX_ENABLED:
         abort(500, description="python-docx is not installed. Run: pip install python-docx")
     if not os.path.isfile(template_path):
         abort(500, description=f"Word template not found: {template_path}")
 
-    rows = _sort_rows(rows)  # always sort before writing
-
-    doc = Document(template_path)  # keeps header/footer/art & existing tables
-    _docx_set_defaults(doc)
+    mtime = os.path.getmtime(template_path)
+    doc = Document(BytesIO(_prebaked_template_bytes(template_path, mtime)))  # keeps header/footer/art & existing tables
 
-    if not _fill_template_tables(doc, cls_dict, rows, type_of_test_text=type_of_test_text):
+    if not _fill_template_tables(
+        doc, cls_dict, rows,
+        type_of_test_text=type_of_test_text,
+        template_key=(template_path, mtime),
+    ):
         _fallback_build(doc, cls_dict, rows, title1=title1, title2=title2, type_of_test_text=type_of_test_text)
 
-    bio = BytesIO()
+    # small documents stay in memory, large exports spill to a temp file
+    bio = tempfile.SpooledTemporaryFile(max_size=_DOCX_SPOOL_MAX)
     doc.save(bio)
     bio.seek(0)
     return bio
 
-def _build_gst_docx_eng(cls_dict: dict, rows: List[dict]) -> BytesIO:
+def _build_gst_docx_eng(cls_dict: dict, rows: List[dict]) -> IO[bytes]:
     return _build_gst_docx_from_template(
         cls_dict, rows,
         template_path=_template_path_eng(),
@@ -312,7 +560,7 @@ def _build_gst_docx_eng(cls_dict: dict, rows: List[dict]) -> BytesIO:
         type_of_test_text="Screening Test Level (English)"
     )
 
-def _build_gst_docx_fil(cls_dict: dict, rows: List[dict]) -> BytesIO:
+def _build_gst_docx_fil(cls_dict: dict, rows: List[dict]) -> IO[bytes]:
     return _build_gst_docx_from_template(
         cls_dict, rows,
         template_path=_template_path_fil(),
@@ -321,9 +569,29 @@ def _build_gst_docx_fil(cls_dict: dict, rows: List[dict]) -> BytesIO:
         type_of_test_text="Screening Test Level (Filipino)"
     )
 
+def _send_spooled(f: IO[bytes], *, download_name: str, mimetype: str):
+    """
+    send_file() for a SpooledTemporaryFile. Werkzeug only sizes paths and
+    BytesIO, so Content-Length and Range/conditional handling are applied here.
+    """
+    size = f.seek(0, os.SEEK_END)
+    f.seek(0)
+    resp = send_file(
+        f,
+        as_attachment=True,
+        download_name=download_name,
+        mimetype=mimetype,
+        conditional=False,
+    )
+    resp.content_length = size
+    return resp.make_conditional(request, accept_ranges=True, complete_length=size)
+
 # ---------------- Routes ----------------
 def init_db():
     db.create_all()
+    # create_all() skips indexes on tables that already exist
+    for ix in Learner.__table__.indexes:
+        ix.create(db.engine, checkfirst=True)
     if Class.query.count() == 0:
         c = Class(
             teacher="", school="", grade=7, section="",
@@ -387,23 +655,28 @@ def class_update_meta(class_id):
 @app.post("/api/class/<int:class_id>/learners/save")
 def api_learners_save(class_id):
     _ = Class.query.get_or_404(class_id)
-    rows = request.get_json(force=True).get("rows", [])
+    # get_json() decodes through app.json (orjson when installed); bad bodies -> 400
+    rows = (request.get_json(force=True) or {}).get("rows", [])
+    mappings = [
+        {
+            "class_id": class_id,
+            "name": (r.get("name", "") or "").strip(),
+            "gender": (r.get("gender", "M") or "M")[:1].upper(),
+            "took_eng": bool(r.get("took_eng", True)),
+            "took_fil": bool(r.get("took_fil", True)),
+            "eng_literal": int(r.get("eng_literal", 0) or 0),
+            "eng_inferential": int(r.get("eng_inferential", 0) or 0),
+            "eng_critical": int(r.get("eng_critical", 0) or 0),
+            "fil_literal": int(r.get("fil_literal", 0) or 0),
+            "fil_inferential": int(r.get("fil_inferential", 0) or 0),
+            "fil_critical": int(r.get("fil_critical", 0) or 0),
+        }
+        for r in rows
+    ]
+    # delete + batched insert share one transaction; nothing is written until commit
     Learner.query.filter_by(class_id=class_id).delete()
-    for r in rows:
-        L = Learner(
-            class_id=class_id,
-            name=(r.get("name", "") or "").strip(),
-            gender=(r.get("gender", "M") or "M")[:1].upper(),
-            took_eng=bool(r.get("took_eng", True)),
-            took_fil=bool(r.get("took_fil", True)),
-            eng_literal=int(r.get("eng_literal", 0) or 0),
-            eng_inferential=int(r.get("eng_inferential", 0) or 0),
-            eng_critical=int(r.get("eng_critical", 0) or 0),
-            fil_literal=int(r.get("fil_literal", 0) or 0),
-            fil_inferential=int(r.get("fil_inferential", 0) or 0),
-            fil_critical=int(r.get("fil_critical", 0) or 0),
-        )
-        db.session.add(L)
+    if mappings:
+        db.session.bulk_insert_mappings(Learner, mappings)
     db.session.commit()
     return jsonify({"ok": True})
 
@@ -458,83 +731,49 @@ def form1b(class_id):
 @app.get("/gst/en/<int:class_id>")
 def gst_en(class_id):
     c = Class.query.get_or_404(class_id)
-    learners = Learner.query.filter_by(class_id=class_id).order_by(Learner.name.asc()).all()
-    rows = []
-    for s in learners:
-        if not s.took_eng:
-            continue
-        total = compute_total(s.eng_literal, s.eng_inferential, s.eng_critical)
-        sp = starting_point_for(c.grade, total)
-        if sp != "DISCONTINUE":
-            rows.append({"name": s.name, "gender": s.gender, "score": total, "start": sp})
-    rows = _sort_rows(rows)
+    rows = _collect_gst_rows(c, "eng")
     return render_template("gst_en.html", cls=c, rows=rows)
 
 @app.get("/gst/en/<int:class_id>/export")
 def export_gst_en_docx(class_id):
     c = Class.query.get_or_404(class_id)
-    learners = Learner.query.filter_by(class_id=class_id).order_by(Learner.name.asc()).all()
-    rows = []
-    for s in learners:
-        if not s.took_eng:
-            continue
-        total = compute_total(s.eng_literal, s.eng_inferential, s.eng_critical)
-        sp = starting_point_for(c.grade, total)
-        if sp != "DISCONTINUE":
-            rows.append({"name": s.name, "gender": s.gender, "score": total, "start": sp})
-    rows = _sort_rows(rows)
-    cls_dict = {
-        "teacher": c.teacher, "school": c.school, "grade": c.grade,
-        "section": c.section, "date_text": c.date_text
-    }
+    rows = _collect_gst_rows(c, "eng")
+    cls_dict = _cls_dict(c)
     bio = _build_gst_docx_eng(cls_dict, rows)
-    return send_file(
-        bio,
-        as_attachment=True,
-        download_name=f"ENGLISH_GST_RESULTS_{class_id}.docx",
-        mimetype="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-    )
+    return _send_spooled(bio, download_name=f"ENGLISH_GST_RESULTS_{class_id}.docx", mimetype=DOCX_MIMETYPE)
 
 # --------- GST FILIPINO ----------
 @app.get("/gst/fil/<int:class_id>")
 def gst_fil(class_id):
     c = Class.query.get_or_404(class_id)
-    learners = Learner.query.filter_by(class_id=class_id).order_by(Learner.name.asc()).all()
-    rows = []
-    for s in learners:
-        if not s.took_fil:
-            continue
-        total = compute_total(s.fil_literal, s.fil_inferential, s.fil_critical)
-        sp = starting_point_for(c.grade, total)
-        if sp != "DISCONTINUE":
-            rows.append({"name": s.name, "gender": s.gender, "score": total, "start": sp})
-    rows = _sort_rows(rows)
+    rows = _collect_gst_rows(c, "fil")
     return render_template("gst_fil.html", cls=c, rows=rows)
 
 @app.get("/gst/fil/<int:class_id>/export")
 def export_gst_fil_docx(class_id):
     c = Class.query.get_or_404(class_id)
-    learners = Learner.query.filter_by(class_id=class_id).order_by(Learner.name.asc()).all()
-    rows = []
-    for s in learners:
-        if not s.took_fil:
-            continue
-        total = compute_total(s.fil_literal, s.fil_inferential, s.fil_critical)
-        sp = starting_point_for(c.grade, total)
-        if sp != "DISCONTINUE":
-            rows.append({"name": s.name, "gender": s.gender, "score": total, "start": sp})
-    rows = _sort_rows(rows)
-    cls_dict = {
-        "teacher": c.teacher, "school": c.school, "grade": c.grade,
-        "section": c.section, "date_text": c.date_text
-    }
+    rows = _collect_gst_rows(c, "fil")
+    cls_dict = _cls_dict(c)
     bio = _build_gst_docx_fil(cls_dict, rows)
-    return send_file(
-        bio,
-        as_attachment=True,
-        download_name=f"FILIPINO_GST_RESULTS_{class_id}.docx",
-        mimetype="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-    )
+    return _send_spooled(bio, download_name=f"FILIPINO_GST_RESULTS_{class_id}.docx", mimetype=DOCX_MIMETYPE)
+
+# --------- GST ENGLISH + FILIPINO ----------
+@app.get("/gst/both/<int:class_id>/export")
+def export_gst_both_zip(class_id):
+    c = Class.query.get_or_404(class_id)
+    rows_eng, rows_fil = _collect_gst_rows_both(c)
+    cls_dict = _cls_dict(c)
+    out = tempfile.SpooledTemporaryFile(max_size=_DOCX_SPOOL_MAX)
+    # .docx files are already deflated, so they are stored as-is
+    with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_STORED) as zf:
+        for name, bio in (
+            (f"ENGLISH_GST_RESULTS_{class_id}.docx", _build_gst_docx_eng(cls_dict, rows_eng)),
+            (f"FILIPINO_GST_RESULTS_{class_id}.docx", _build_gst_docx_fil(cls_dict, rows_fil)),
+        ):
+            with bio:
+                zf.writestr(name, bio.read())
+    out.seek(0)
+    return _send_spooled(out, download_name=f"GST_RESULTS_{class_id}.zip", mimetype="application/zip")
 
 # ======== Legacy POST (kept for compatibility; uses English template) ========
 @app.post("/export-gst-docx")
@@ -542,14 +781,9 @@ def export_gst_docx_post():
     data = request.get_json(force=True) or {}
     cls_dict = data.get("cls", {}) or {}
     rows = data.get("rows", []) or []
-    rows = _sort_rows(rows)
+    rows = _sort_rows(rows)  # arbitrary client input; DB-backed routes arrive SQL-ordered
     bio = _build_gst_docx_eng(cls_dict, rows)
-    return send_file(
-        bio,
-        as_attachment=True,
-        download_name="ENGLISH_GST_RESULTS.docx",
-        mimetype="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-    )
+    return _send_spooled(bio, download_name="ENGLISH_GST_RESULTS.docx", mimetype=DOCX_MIMETYPE)
 
 # ---------------------------------------
 if __name__ == "__main__":